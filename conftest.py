@@ -2,45 +2,82 @@ import pytest
 from pathlib import Path
 from collections import defaultdict
 from datetime import datetime
+import io
 import os
-import statistics
 import numpy as np
 
 # Global dictionary to collect test results
 TEST_RESULTS = defaultdict(lambda: defaultdict(dict))
-# Global dictionary to collect timing results
-TIMING_RESULTS = defaultdict(lambda: defaultdict(list))
+# Global dictionary to collect timing results, as float64 arrays
+TIMING_RESULTS = defaultdict(dict)
+# Global set of providers that reported results, so the report needn't rescan TEST_RESULTS
+SEEN_PROVIDERS = set()
+
+
+def pytest_collection_modifyitems(session, config, items):
+    """Resolve each evaluation item's (test_id, provider_name) once, at collection time."""
+    for item in items:
+        if not item.name.startswith("test_extract_calories") or not hasattr(item, "callspec"):
+            continue
+        params = item.callspec.params
+        test_id = params.get("id")
+        provider = params.get("provider")
+        if test_id and provider:
+            provider_name = provider["model"] + (' on ' + provider["api_base"] if provider.get("api_base") else '')
+            item._evaluation_key = (test_id, provider_name)
 
 
 @pytest.hookimpl(tryfirst=True, hookwrapper=True)
 def pytest_runtest_makereport(item, call):
-    """Hook to capture test results after each test run."""
+    """
+    Hook to capture test results after each test run.
+
+    Results travel on the report's user_properties, so they also reach the controller
+    process when the session is distributed with pytest-xdist (e.g. `-n auto`).
+    """
     outcome = yield
     report = outcome.get_result()
 
-    # Only process if this is a test_extract_calories test in the call phase
-    if report.when == "call" and item.name.startswith("test_extract_calories"):
-        # Extract test_id and provider from test parameters
-        if hasattr(item, "callspec"):
-            params = item.callspec.params
-            test_id = params.get("id")
-            provider = params.get("provider")
-
-            if test_id and provider:
-                provider_name = provider["model"] + (' on ' + provider["api_base"] if provider.get("api_base") else '')
-
-                # Check if repeated summary is available
-                if hasattr(item, "_repeated_summary"):
-                    passed, total = item._repeated_summary
-                    TEST_RESULTS[test_id][provider_name] = {"passed": passed, "total": total}
-
-                    # Collect timing data if available
-                    if hasattr(item, "_timing_data"):
-                        TIMING_RESULTS[test_id][provider_name] = item._timing_data
+    if hasattr(item.config, "workerinput"):
+        # pytest-repeated attaches objects execnet cannot serialize to the report.
+        # They only drive its local -vvv output, so drop them before the report is sent.
+        for attr in ("config", "_repeated_last_exception"):
+            report.__dict__.pop(attr, None)
+
+    # Only process evaluation items (see pytest_collection_modifyitems) in the call phase
+    if report.when != "call":
+        return
+    try:
+        test_id, provider_name = item._evaluation_key
+        passed, total = item._repeated_summary
+    except AttributeError:
+        # Not an evaluation item, or no repeated summary available
+        return
+
+    # Collect timing data if available
+    timings = getattr(item, "_timing_data", None)
+    report.user_properties.append(
+        ("evaluation_result", (test_id, provider_name, passed, total, timings))
+    )
+
+
+def pytest_runtest_logreport(report):
+    """Record the results attached by pytest_runtest_makereport."""
+    for name, value in report.user_properties:
+        if name == "evaluation_result":
+            test_id, provider_name, passed, total, timings = value
+            TEST_RESULTS[test_id][provider_name] = {"passed": passed, "total": total}
+            SEEN_PROVIDERS.add(provider_name)
+            if timings:
+                TIMING_RESULTS[test_id][provider_name] = np.fromiter(timings, dtype=np.float64, count=len(timings))
 
 
 def pytest_sessionfinish(session, exitstatus):
     """Generate markdown table at the end of test session."""
+    # pytest-xdist workers hand their results to the controller, which writes the report
+    if hasattr(session.config, "workerinput"):
+        return
+
     print(f"\n[DEBUG] Session finishing. TEST_RESULTS has {len(TEST_RESULTS)} test cases")
 
     # Create results directory and timestamped filename
@@ -53,65 +90,63 @@ def pytest_sessionfinish(session, exitstatus):
     output_path = results_dir / f"{datestamp}.md"
 
     # Get all unique providers and test cases
-    providers = sorted(set(provider for test_results in TEST_RESULTS.values()
-                          for provider in test_results.keys()))
+    providers = sorted(SEEN_PROVIDERS)
     test_ids = sorted(TEST_RESULTS.keys())
 
     print(f"[DEBUG] Providers: {providers}")
     print(f"[DEBUG] Test IDs: {test_ids}")
 
-    # Build markdown table
-    lines = []
-    lines.append(f"# Test Results ({now.strftime('%Y-%m-%d %H:%M:%S')})\n")
+    # Build markdown table in an in-memory buffer, written out in one go
+    buf = io.StringIO()
+    buf.write(f"# Test Results ({now.strftime('%Y-%m-%d %H:%M:%S')})\n\n")
 
     # Header row
     header = "| Test Case | " + " | ".join(providers) + " |"
-    lines.append(header)
+    buf.write(header + "\n")
 
     # Separator row
     separator = "|" + "---|" * (len(providers) + 1)
-    lines.append(separator)
-
-    # Data rows
-    for test_id in test_ids:
-        row = f"| {test_id} |"
-        for provider in providers:
-            result = TEST_RESULTS[test_id].get(provider, {})
-            passed = result.get('passed', 0)
-            total = result.get('total', 0)
-            cell = f" {passed}/{total}" if total > 0 else " - "
-            row += cell + " |"
-        lines.append(row)
+    buf.write(separator + "\n")
+
+    # Data rows: gather passed/total counts into (test, provider) matrices and format all cells at once
+    provider_index = {provider: j for j, provider in enumerate(providers)}
+    passed_mat = np.zeros((len(test_ids), len(providers)), dtype=np.int64)
+    total_mat = np.zeros_like(passed_mat)
+    for i, test_id in enumerate(test_ids):
+        for provider, result in TEST_RESULTS[test_id].items():
+            passed_mat[i, provider_index[provider]] = result["passed"]
+            total_mat[i, provider_index[provider]] = result["total"]
+    cells = np.where(total_mat > 0,
+                     np.char.add(np.char.add(passed_mat.astype(str), "/"), total_mat.astype(str)),
+                     "-")
+    for test_id, row in zip(test_ids, cells.tolist()):
+        buf.write("| " + test_id + " | " + " | ".join(row) + " |\n")
 
     # Add timing statistics section if we have timing data
     if any(TIMING_RESULTS.values()):
-        lines.append("\n## Timing Statistics (seconds)\n")
+        buf.write("\n## Timing Statistics (seconds)\n\n")
 
         # Header row for timing stats
         timing_header = "| Provider | Min | Max | Avg | Median | 98th %ile |"
-        lines.append(timing_header)
-        lines.append("|---|---|---|---|---|---|")
+        buf.write(timing_header + "\n")
+        buf.write("|---|---|---|---|---|---|\n")
 
         # Calculate timing stats per provider across all test cases
         for provider in providers:
-            all_timings = []
-            for test_id in test_ids:
-                timings = TIMING_RESULTS[test_id].get(provider, [])
-                all_timings.extend(timings)
-
-            if all_timings:
-                min_time = min(all_timings)
-                max_time = max(all_timings)
-                avg_time = statistics.mean(all_timings)
-                median_time = statistics.median(all_timings)
-                p98_time = np.percentile(all_timings, 98)
+            provider_timings = [TIMING_RESULTS[test_id][provider] for test_id in test_ids
+                                if provider in TIMING_RESULTS[test_id]]
+
+            if provider_timings:
+                timings_arr = np.concatenate(provider_timings)
+                min_time, median_time, p98_time, max_time = np.percentile(timings_arr, [0, 50, 98, 100])
+                avg_time = timings_arr.mean()
 
                 timing_row = f"| {provider} | {min_time:.3f} | {max_time:.3f} | {avg_time:.3f} | {median_time:.3f} | {p98_time:.3f} |"
-                lines.append(timing_row)
+                buf.write(timing_row + "\n")
 
     # Write to file
     if test_ids:
-        output_path.write_text("\n".join(lines) + "\n")
+        output_path.write_bytes(buf.getvalue().encode("utf-8"))
         print(f"\n✓ Results written to {output_path}")
     else:
         print(f"\n. Nothing to write.")
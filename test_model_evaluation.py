@@ -1,35 +1,46 @@
+import atexit
+import functools
 import os
+import pickle
 import warnings
 import time
-from typing import Any, Dict, List
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 import re
 import yaml
-import json
 import pytest
-import re
-import warnings
-import yaml
 from pathlib import Path
 from time import sleep
-from typing import Any, Dict, List
+from types import MappingProxyType
+from typing import Any, Dict, FrozenSet, List, NamedTuple, Optional, Tuple
 
 from litellm import completion
 from helpers.evaluation_helpers import (
+    JPEG_ENCODER_VERSION,
+    _json_loads,
     convert_image_to_jpeg_base64,
     expect_equality,
     expect_in_range,
     expect_approx_pct
 )
 
+try:
+    # LibYAML-backed C parser, much faster than the pure-Python one
+    from yaml import CSafeLoader as _YamlLoader
+except ImportError:
+    from yaml import SafeLoader as _YamlLoader
+
 
-# Get the LLM providers from environment variables
+# Snapshot of the environment taken at import; provider files look variables up here
+_ENV_CACHE = dict(os.environ)
+_getenv = _ENV_CACHE.get
 
 
 # Load providers from YAML files in the providers directory
 PROVIDERS = []
 
 # Get PROJECT_PATH from environment (required)
-PROJECT_PATH_STR = os.getenv('PROJECT_PATH')
+PROJECT_PATH_STR = _getenv('PROJECT_PATH')
 if not PROJECT_PATH_STR:
     raise RuntimeError("PROJECT_PATH environment variable is required")
 PROJECT_PATH = Path(PROJECT_PATH_STR)
@@ -45,25 +56,127 @@ RESULTS_DIR = PROJECT_PATH / "results"
 RESULTS_DIR.mkdir(exist_ok=True)
 
 
+def load_pickle_cache(path: Path) -> Dict[Any, Any]:
+    """Load a pickled cache dict, or start an empty one if it is missing or unreadable."""
+    try:
+        with open(path, "rb") as f:
+            cache = pickle.load(f)
+    except Exception:
+        return {}
+    return cache if isinstance(cache, dict) else {}
+
+
+def save_pickle_cache(path: Path, cache: Dict[Any, Any]) -> None:
+    """Atomically write a cache dict; caches are an optimization, so failures are ignored."""
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    try:
+        with open(tmp_path, "wb") as f:
+            pickle.dump(cache, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+    except OSError:
+        tmp_path.unlink(missing_ok=True)
+
+
+# Parsed YAML files (providers and evaluations), keyed by (path, size, mtime) so edited
+# files are re-parsed. This is the only on-disk cache of those parses.
+# Values are pickled, so every caller gets its own copy to modify.
+YAML_CACHE_PATH = RESULTS_DIR / ".yaml_cache.pkl"
+_YAML_CACHE = load_pickle_cache(YAML_CACHE_PATH)
+# Entries used in this run
+_YAML_CACHE_USED = {}
+
+
+@atexit.register
+def _save_yaml_cache() -> None:
+    # Keep the entries of files this run did not load, unless the file is gone;
+    # entries for earlier versions of the files it did load are replaced.
+    used_paths = {key[0] for key in _YAML_CACHE_USED}
+    cache = {key: blob for key, blob in _YAML_CACHE.items()
+             if key[0] not in used_paths and os.path.exists(key[0])}
+    cache.update(_YAML_CACHE_USED)
+    if cache != _YAML_CACHE:
+        save_pickle_cache(YAML_CACHE_PATH, cache)
+
+
+def load_yaml(path: Path) -> Any:
+    """Parse a YAML file, reusing the parse result from an earlier run if the file is unchanged."""
+    st = path.stat()
+    key = (str(path), st.st_size, st.st_mtime_ns)
+    blob = _YAML_CACHE.get(key)
+    if blob is None:
+        with open(path, "rb") as f:
+            blob = pickle.dumps(yaml.load(f, Loader=_YamlLoader), protocol=pickle.HIGHEST_PROTOCOL)
+    _YAML_CACHE_USED[key] = blob
+    return pickle.loads(blob)
+
+
+# File extensions of YAML files (providers and evaluations) and of prompt files
+_YAML_EXTS = frozenset(('.yaml', '.yml'))
+_PROMPT_EXTS = frozenset(('.md',))
+
+
+def find_yaml_files(root: Path, recursive: bool = False) -> List[Path]:
+    """Sorted .yaml / .yml files in a directory (and its subdirectories, if recursive).
+
+    Walks with os.scandir, whose entries already know their type, rather than glob.
+    Symlinked directories are not followed, so links cannot loop or duplicate cases.
+    """
+    found = []
+    stack = [str(root)]
+    while stack:
+        with os.scandir(stack.pop()) as entries:
+            for entry in entries:
+                if entry.is_file():
+                    if os.path.splitext(entry.name)[1] in _YAML_EXTS:
+                        found.append(Path(entry.path))
+                elif recursive and entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+    return sorted(found)
+
+
+# ${VAR_NAME} references in provider files
+_ENV_VAR_RE = re.compile(r'\$\{([A-Za-z_][A-Za-z0-9_]*)\}')
+
+
+def _replace_env_var(match: re.Match) -> str:
+    """Replace one ${VAR_NAME} match with the variable's value, leaving unset variables as-is."""
+    return _getenv(match.group(1), match.group(0))
+
+
+def _substitute_str(value: str) -> str:
+    # Most strings contain no variable at all; skip the regex engine for them
+    if '${' not in value:
+        return value
+    return _ENV_VAR_RE.sub(_replace_env_var, value)
+
+
 def substitute_env_vars(obj: Any) -> Any:
-    """Recursively substitute ${VAR_NAME} with environment variable values."""
+    """Substitute ${VAR_NAME} with environment variable values, in place, in nested dicts and lists."""
     if isinstance(obj, str):
-        # Replace ${VAR_NAME} with environment variable
-        def replace_var(match):
-            var_name = match.group(1)
-            return os.getenv(var_name, match.group(0))
-        return re.sub(r'\$\{([A-Za-z_][A-Za-z0-9_]*)\}', replace_var, obj)
-    elif isinstance(obj, dict):
-        return {k: substitute_env_vars(v) for k, v in obj.items()}
-    elif isinstance(obj, list):
-        return [substitute_env_vars(item) for item in obj]
+        return _substitute_str(obj)
+    stack = [obj]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, dict):
+            items = node.items()
+        elif isinstance(node, list):
+            items = enumerate(node)
+        else:
+            continue
+        for key, value in items:
+            if isinstance(value, str):
+                if '${' in value:
+                    node[key] = _substitute_str(value)
+            elif isinstance(value, (dict, list)):
+                stack.append(value)
     return obj
 
-# Load provider YAML files
-for provider_file in sorted(PROVIDERS_DIR.glob("*.yaml")):
-    with open(provider_file, "r") as f:
-        provider_config = yaml.safe_load(f)
-
+# Load provider YAML files, keyed by (model, api_base) so the same endpoint is only evaluated once
+providers_by_key = {}
+provider_files = find_yaml_files(PROVIDERS_DIR)
+with ThreadPoolExecutor(max_workers=min(32, len(provider_files) or 1)) as executor:
+    provider_configs = list(executor.map(load_yaml, provider_files))
+for provider_file, provider_config in zip(provider_files, provider_configs):
     # Substitute environment variables
     provider_config = substitute_env_vars(provider_config)
 
@@ -82,12 +195,221 @@ for provider_file in sorted(PROVIDERS_DIR.glob("*.yaml")):
     # Remove _enabled before adding to PROVIDERS (it's not a LiteLLM kwarg)
     provider_config.pop("_enabled", None)
 
-    PROVIDERS.append(provider_config)
+    provider_key = (provider_config["model"].strip(), (provider_config.get("api_base") or "").strip())
+    if provider_key in providers_by_key:
+        warnings.warn(f"Provider {provider_file.name} duplicates an already loaded provider; skipping it")
+        continue
+    providers_by_key[provider_key] = provider_config
+
+PROVIDERS.extend(providers_by_key.values())
+
+# LiteLLM kwargs taken from the provider config, built once instead of on every call.
+# Read-only, since every test of the provider shares it.
+for provider_config in PROVIDERS:
+    provider_config["_kwargs"] = MappingProxyType({k: provider_config[k]
+                                                   for k in ('model', 'api_base', 'api_key', 'max_tokens')
+                                                   if provider_config.get(k)})
+
+# Prompt files are usually shared by many cases (e.g. a top-level prompt_path); read each once
+_PROMPT_CACHE: Dict[Path, str] = {}
+
+# Images of an evaluation file usually share a few directories; list each directory
+# once instead of stat'ing every referenced image
+@functools.lru_cache(maxsize=None)
+def _dir_entries(d: Path) -> FrozenSet[str]:
+    """Cached listing of a directory's entry names (empty if it does not exist)."""
+    try:
+        return frozenset(os.listdir(d))
+    except (FileNotFoundError, NotADirectoryError):
+        return frozenset()
+
+
+def _exists(p: Path) -> bool:
+    """Path.exists() answered from the cached listing of the parent directory."""
+    return p.name in _dir_entries(p.parent)
+
+
+def read_prompt(p: Path, prompt_path: str) -> str:
+    """Read a prompt file once, with a single syscall on the first read."""
+    prompt = _PROMPT_CACHE.get(p)
+    if prompt is None:
+        try:
+            prompt = p.read_bytes().decode('utf-8')
+        except FileNotFoundError:
+            raise FileNotFoundError(f"Prompt file not found: {prompt_path}") from None
+        _PROMPT_CACHE[p] = prompt
+    return prompt
+
+
+# Encoding settings of the images sent to the models
+IMAGE_QUALITY = 60
+IMAGE_MAX_SIDE = 1568
+IMAGE_PASSTHROUGH_MAX_BYTES = 512 * 1024
+
+# Image data URLs, keyed by the file's (resolved path, size, mtime) and everything else
+# that shapes the encoding. The same image is often referenced by several cases and
+# evaluation files; decode and encode it only once. The cache is kept across runs,
+# so an unchanged image is never even read again.
+IMG_CACHE_PATH = RESULTS_DIR / ".img_cache.pkl"
+_IMG_CACHE: Dict[tuple, str] = load_pickle_cache(IMG_CACHE_PATH)
+# Entries used in this run
+_IMG_CACHE_USED: Dict[tuple, str] = {}
+_IMG_CACHE_ENCODED = False
+
+
+@atexit.register
+def _save_img_cache() -> None:
+    if not _IMG_CACHE_ENCODED:
+        return
+    # Merge into the file as it is now, so that pytest-xdist workers keep each other's
+    # entries. Keep the entries of images this run did not use, unless the file is gone;
+    # entries for earlier versions (or encodings) of the images it did use are replaced.
+    used_paths = {key[0] for key in _IMG_CACHE_USED}
+    cache = {key: image_url for key, image_url in load_pickle_cache(IMG_CACHE_PATH).items()
+             if key[0] not in used_paths and os.path.exists(key[0])}
+    cache.update(_IMG_CACHE_USED)
+    save_pickle_cache(IMG_CACHE_PATH, cache)
+
+
+def load_image_data_url(path: Path, quality: int = IMAGE_QUALITY) -> str:
+    """Return the JPEG base64 data URL for an image, reusing an earlier encoding of the same file."""
+    global _IMG_CACHE_ENCODED
+    st = path.stat()
+    key = (str(path.resolve()), st.st_size, st.st_mtime_ns,
+           JPEG_ENCODER_VERSION, quality, IMAGE_MAX_SIDE, IMAGE_PASSTHROUGH_MAX_BYTES)
+    image_url = _IMG_CACHE_USED.get(key) or _IMG_CACHE.get(key)
+    if image_url is None:
+        image_url = convert_image_to_jpeg_base64(path, quality=quality,
+                                                 passthrough_max_bytes=IMAGE_PASSTHROUGH_MAX_BYTES,
+                                                 max_side=IMAGE_MAX_SIDE)
+        _IMG_CACHE_ENCODED = True
+    _IMG_CACHE_USED[key] = image_url
+    return image_url
+
+
+def resolve_message_content(content: Tuple[Dict[str, Any], ...]) -> List[Dict[str, Any]]:
+    """Turn the image_path parts of a parsed step into image_url parts for the LLM call."""
+    return [
+        {"type": "image_url", "image_url": {"url": load_image_data_url(part["image_path"])}}
+        if part["type"] == "image_path" else part
+        for part in content
+    ]
+
+
+# Expectation types (and aliases) that match the response against a regular expression
+REGEX_EXPECTATION_TYPES = frozenset(("regex", "regexp", "regular_expression", "match"))
+
+
+@dataclass(slots=True, frozen=True)
+class Step:
+    """One parsed step of an evaluation case; held by pytest for the whole session."""
+    content: Tuple[Dict[str, Any], ...]
+    max_tokens: Optional[int]
+    expectations: Tuple[Dict[str, Any], ...]
+    # Whether the response is parsed as JSON for the equals / oneOf expectations
+    parse_json: bool
+
+
+class EvaluationCases(NamedTuple):
+    """All parsed evaluation cases, as parallel lists with one entry per case."""
+    ids: List[str]
+    repeats: List[Any]
+    thresholds: List[Any]
+    steps: List[Tuple[Step, ...]]
+
 
 # -------- YAML loader / parser (multi-step format) ----------
-def load_evaluation_cases() -> List[Dict[str, Any]]:
+def parse_evaluation_file(yaml_file: Path) -> List[Dict[str, Any]]:
+    """Parse the cases of one evaluation YAML file."""
+    tests = []
+    data = load_yaml(yaml_file)
+
+    # Base directory for resolving relative paths in this YAML file
+    yaml_dir = yaml_file.parent
+
+    top_level_prompt = data.get('prompt')
+    top_level_prompt_path = data.get('prompt_path')
+    if top_level_prompt and top_level_prompt_path:
+        raise ValueError(f"Cannot have both 'prompt' and 'prompt_path'."
+                         "Either write the prompt into the YAML file or provide a prompt file path.")
+    top_level_repeat = data.get("repeat")
+    top_level_threshold = data.get("threshold")
+    for test in data.get("cases", []):
+        test_id = test.get("id")
+        repeat = test.get("repeat", top_level_repeat)
+        threshold = test.get("threshold", top_level_threshold)
+        steps = test.get("steps", [])
+        if not test_id:
+            raise ValueError("Every test must have an 'id'.")
+        if not steps:
+            raise ValueError(f"Test '{test_id}' must contain at least one step.")
+        parsed_steps = []
+        for idx, step in enumerate(steps):
+            step_content = []
+            inp = step.get("input", {})
+            prompt = inp.get("prompt") or top_level_prompt
+            prompt_path = inp.get("prompt_path") or top_level_prompt_path
+            img_path = inp.get("image_path")
+            max_tokens = inp.get("max_tokens")
+            if max_tokens is not None:
+                max_tokens = int(max_tokens)
+            if not (prompt or prompt_path) and not img_path:
+                raise ValueError(f"Test '{test_id}', step {idx}: need text or image.")
+            if (prompt and not top_level_prompt) and (prompt_path and not top_level_prompt_path):
+                raise ValueError(f"Test '{test_id}', step {idx}: cannot have both 'prompt' and 'prompt_path'."
+                                 "Either write the prompt into the YAML file or provide a prompt file path.")
+            if prompt_path and os.path.splitext(prompt_path)[1] not in _PROMPT_EXTS:
+                raise ValueError(f"Test '{test_id}', step {idx}: prompt_path must point to a .md file.")
+            image_path = None
+            if img_path:
+                # Resolve image path relative to the YAML file's directory
+                p = yaml_dir / img_path
+                if not _exists(p):
+                    raise FileNotFoundError(f"Image not found: {img_path} (resolved to {p})")
+                image_path = p
+
+            if prompt:
+                step_content.append({
+                    "type": "text",
+                    "text": prompt
+                })
+            if prompt_path:
+                step_content.append({
+                    "type": "text",
+                    "text": read_prompt(PROMPT_FOLDER / prompt_path, prompt_path)
+                })
+            if image_path:
+                # Encoded when the test runs (see resolve_message_content),
+                # so cases deselected with -k never decode their images
+                step_content.append({
+                    "type": "image_path",
+                    "image_path": image_path
+                })
+            expectations = step.get("expectations", [])
+            for expectation in expectations:
+                # Compile regex expectations once here rather than on every repeated run
+                if expectation.get("type") in REGEX_EXPECTATION_TYPES:
+                    expectation["_compiled"] = re.compile(expectation["value"])
+            # Parse the response as JSON if any expectation expects a dict-shaped value.
+            # This includes direct `value` dicts as well as `oneOf`/`values` lists
+            # where each candidate is a dict.
+            parse_json = any(
+                isinstance(expectation.get("value"), dict)
+                or (isinstance(expectation.get("values"), list)
+                    and any(isinstance(v, dict) for v in expectation["values"]))
+                for expectation in expectations
+            )
+            parsed_steps.append(Step(tuple(step_content), max_tokens, tuple(expectations), parse_json))
+        tests.append({"id": test_id,
+                      "repeat": repeat,
+                      "threshold": threshold,
+                      "steps": tuple(parsed_steps)})
+    return tests
+
+
+def load_evaluation_cases() -> EvaluationCases:
     # Get evaluation path from environment variable or use default
-    evaluation_path_str = os.getenv('EVALUATION_PATH', 'evaluation')
+    evaluation_path_str = _getenv('EVALUATION_PATH', 'evaluation')
 
     # If EVALUATION_PATH is relative, make it relative to PROJECT_PATH
     evaluation_path = Path(evaluation_path_str)
@@ -99,135 +421,237 @@ def load_evaluation_cases() -> List[Dict[str, Any]]:
 
     # If it's a file, load just that file
     if evaluation_path.is_file():
-        if not evaluation_path.suffix == '.yaml':
+        if evaluation_path.suffix not in _YAML_EXTS:
             raise ValueError(f"Evaluation file must be a YAML file: {evaluation_path}")
         yaml_files = [evaluation_path]
     else:
         # If it's a directory, find all YAML files recursively
-        yaml_files = sorted(evaluation_path.glob("**/*.yaml"))
+        yaml_files = find_yaml_files(evaluation_path, recursive=True)
 
     if not yaml_files:
         raise RuntimeError(f"No YAML files found in: {evaluation_path}")
 
+    # Files are independent; overlap their reads (and any parsing not served by the cache)
     all_tests = []
-    for yaml_file in yaml_files:
-        with open(yaml_file, "r") as f:
-            data = yaml.safe_load(f)
-
-        # Base directory for resolving relative paths in this YAML file
-        yaml_dir = yaml_file.parent
-
-        top_level_prompt = data.get('prompt')
-        top_level_prompt_path = data.get('prompt_path')
-        if top_level_prompt and top_level_prompt_path:
-            raise ValueError(f"Cannot have both 'prompt' and 'prompt_path'."
-                             "Either write the prompt into the YAML file or provide a prompt file path.")
-        top_level_repeat = data.get("repeat", data.get("repeat"))
-        top_level_threshold = data.get("threshold", data.get("threshold"))
-        for test in data.get("cases", []):
-            test_id = test.get("id")
-            repeat = test.get("repeat", top_level_repeat)
-            threshold = test.get("threshold", top_level_threshold)
-            steps = test.get("steps", [])
-            if not test_id:
-                raise ValueError("Every test must have an 'id'.")
-            if not steps:
-                raise ValueError(f"Test '{test_id}' must contain at least one step.")
-            parsed_steps = []
-            for idx, step in enumerate(steps):
-                step_content = []
-                inp = step.get("input", {})
-                prompt = inp.get("prompt") or top_level_prompt
-                prompt_path = inp.get("prompt_path") or top_level_prompt_path
-                img_path = inp.get("image_path")
-                max_tokens = int(inp.get("max_tokens")) if inp.get("max_tokens") is not None else None
-                if not (prompt or prompt_path) and not img_path:
-                    raise ValueError(f"Test '{test_id}', step {idx}: need text or image.")
-                if (prompt and not top_level_prompt) and (prompt_path and not top_level_prompt_path):
-                    raise ValueError(f"Test '{test_id}', step {idx}: cannot have both 'prompt' and 'prompt_path'."
-                                     "Either write the prompt into the YAML file or provide a prompt file path.")
-                if prompt_path and not prompt_path.endswith('.md'):
-                    raise ValueError(f"Test '{test_id}', step {idx}: prompt_path must point to a .md file.")
-                image_url = None
-                if img_path:
-                    # Resolve image path relative to the YAML file's directory
-                    p = yaml_dir / Path(img_path)
-                    if not p.exists():
-                        raise FileNotFoundError(f"Image not found: {img_path} (resolved to {p})")
-
-                    image_url = convert_image_to_jpeg_base64(p, quality=60)
-
-                if prompt:
-                    step_content.append({
-                        "type": "text",
-                        "text": prompt
-                    })
-                if prompt_path:
-                    p = PROMPT_FOLDER / prompt_path
-                    if not p.exists():
-                        raise FileNotFoundError(f"Prompt file not found: {prompt_path}")
-                    prompt = p.read_text()
-                    step_content.append({
-                        "type": "text",
-                        "text": prompt
-                    })
-                if image_url:
-                    step_content.append({
-                        "type": "image_url",
-                        "image_url": {
-                            "url": image_url
-                        }
-                    })
-                expectations = step.get("expectations", [])
-                parsed_steps.append({
-                    "content": step_content,
-                    "max_tokens": max_tokens,
-                    "expectations": expectations,
-                })
-            all_tests.append({"id": test_id,
-                              "repeat": repeat,
-                              "threshold": threshold,
-                              "steps": parsed_steps})
-    return all_tests
+    with ThreadPoolExecutor(max_workers=min(32, len(yaml_files))) as executor:
+        # map() keeps file order, so test ids stay in a stable order
+        for cases in executor.map(parse_evaluation_file, yaml_files):
+            all_tests.extend(cases)
+
+    return EvaluationCases(
+        ids=[test["id"] for test in all_tests],
+        repeats=[test["repeat"] for test in all_tests],
+        thresholds=[test["threshold"] for test in all_tests],
+        steps=[test["steps"] for test in all_tests],
+    )
 
 
 EVALUATION_CASES = load_evaluation_cases()
 
 
-@pytest.mark.parametrize(
-    "id, steps",
-    [
-        pytest.param(
-            c["id"], c["steps"],
-            marks=pytest.mark.repeated(times=c.get("repeat", 100), threshold=c.get("threshold", 0))
-        )
-        for c in EVALUATION_CASES
-    ],
-    ids=[c["id"] for c in EVALUATION_CASES]
-)
-@pytest.mark.parametrize("provider", PROVIDERS, ids=lambda x: x["model"] + (' on ' + x["api_base"] if x.get("api_base") else ''))
-def test_extract_calories(id, steps, provider, request):
+# -------- Expectation handlers ----------
+# Each handler takes the raw response text, the response parsed as JSON where an
+# expectation needs it (otherwise the text itself), and the expectation spec.
+def _expect_contains(actual: str, actual_parsed: Any, expectation: Dict[str, Any]) -> None:
+    assert expectation["value"] in actual, f"Expectation failed: response does not contain '{expectation['value']}'"
+
+
+def _expect_equals(actual: str, actual_parsed: Any, expectation: Dict[str, Any]) -> None:
+    expect_equality(actual_parsed, expectation)
+
+
+def _expect_one_of(actual: str, actual_parsed: Any, expectation: Dict[str, Any]) -> None:
+    expected_values = expectation["values"]
+    if not isinstance(expected_values, list):
+        raise ValueError(f"oneOf expectation requires a list of values, got {type(expected_values)}")
+    errors = []
+    for expected_value in expected_values:
+        try:
+            expect_equality(actual_parsed, {"value": expected_value})
+            return
+        except (AssertionError, Exception) as e:
+            errors.append(str(e))
+    raise AssertionError(f"Expectation failed: response '{actual_parsed}' does not match any of {expected_values}. Errors: {errors}")
+
+
+def _expect_regex(actual: str, actual_parsed: Any, expectation: Dict[str, Any]) -> None:
+    if not expectation["_compiled"].search(actual):
+        raise AssertionError(f"Expectation failed: response '{actual}' does not match regex '{expectation['value']}'")
+
+
+def _expect_in_range(actual: str, actual_parsed: Any, expectation: Dict[str, Any]) -> None:
+    expect_in_range(actual, expectation)
+
+
+def _expect_approx_pct(actual: str, actual_parsed: Any, expectation: Dict[str, Any]) -> None:
+    expect_approx_pct(actual, expectation)
+
+
+# Expectation type (including aliases) -> handler
+EXPECTATION_HANDLERS = {
+    "contains": _expect_contains,
+    "equals": _expect_equals,
+    "oneOf": _expect_one_of,
+    **dict.fromkeys(REGEX_EXPECTATION_TYPES, _expect_regex),
+    **dict.fromkeys(("in_range", "range", "within_range"), _expect_in_range),
+    **dict.fromkeys(("approx_pct", "approximate_percentage", "percent_error", "within_percentage"), _expect_approx_pct),
+}
+
+
+def check_expectations(actual: str, actual_parsed: Any, expectations: Tuple[Dict[str, Any], ...],
+                       _handlers: Dict[str, Any] = EXPECTATION_HANDLERS) -> None:
+    """Run every expectation of a step against the response; the handler table is bound as a local."""
+    for expectation in expectations:
+        handler = _handlers.get(expectation["type"])
+        if handler is None:
+            raise ValueError(f"Unknown expectation type: {expectation['type']}")
+        handler(actual, actual_parsed, expectation)
+
+
+def assemble_response(resp: Any) -> str:
+    """Assemble the response text from streamed response chunks (robust handling)."""
+    assembled = ''
+
+    # Streaming iterator case
+    if hasattr(resp, '__iter__') and not isinstance(resp, dict):
+        for chunk in resp:
+            content = None
+            # Fast path: litellm stream chunks expose choices[0].delta as attributes, so read
+            # the content directly instead of converting every chunk with to_dict()
+            choices = getattr(chunk, 'choices', None) if not isinstance(chunk, dict) else None
+            delta = getattr(choices[0], 'delta', None) if choices else None
+            if delta is not None:
+                content = getattr(delta, 'content', None)
+            else:
+                d = None
+                # Prefer a structured dict representation when available
+                if hasattr(chunk, 'to_dict'):
+                    try:
+                        d = chunk.to_dict()
+                    except Exception:
+                        d = None
+                elif isinstance(chunk, dict):
+                    d = chunk
+
+                if isinstance(d, dict):
+                    # Common streaming shapes: choices[0].delta.content or choices[0].message.content
+                    choices = d.get('choices')
+                    if choices and isinstance(choices, list) and len(choices) > 0:
+                        first = choices[0]
+                        if isinstance(first, dict):
+                            delta = first.get('delta') or {}
+                            if isinstance(delta, dict) and 'content' in delta:
+                                content = delta.get('content')
+                            elif isinstance(first.get('message'), dict):
+                                content = first.get('message', {}).get('content')
+
+                    # fallback top-level fields sometimes used by providers
+                    if content is None:
+                        if 'text' in d:
+                            content = d.get('text')
+                        elif 'content' in d:
+                            content = d.get('content')
+                else:
+                    # primitive chunk shapes
+                    if isinstance(chunk, bytes):
+                        try:
+                            content = chunk.decode('utf-8')
+                        except Exception:
+                            content = str(chunk)
+                    else:
+                        content = str(chunk)
+
+            if content is None:
+                continue
+            if isinstance(content, list):
+                assembled += ''.join(map(str, content))
+            else:
+                assembled += str(content)
+
+    else:
+        # Non-streaming response — try common shapes
+        if isinstance(resp, dict):
+            choices = resp.get('choices')
+            if choices and isinstance(choices, list) and len(choices) > 0:
+                first = choices[0]
+                if isinstance(first, dict):
+                    msg = first.get('message') or {}
+                    if isinstance(msg, dict) and 'content' in msg:
+                        assembled = msg.get('content') or ''
+                    else:
+                        assembled = first.get('text') or first.get('content') or str(first)
+                else:
+                    assembled = str(first)
+            else:
+                assembled = str(resp)
+        else:
+            # Fast path: read choices[0].message.content as attributes, skipping to_dict()
+            choices = getattr(resp, 'choices', None)
+            message = getattr(choices[0], 'message', None) if choices else None
+            if message is not None:
+                return (getattr(message, 'content', None) or '').strip()
+            try:
+                if hasattr(resp, 'to_dict'):
+                    rd = resp.to_dict()
+                    choices = rd.get('choices')
+                    if choices and isinstance(choices, list) and len(choices) > 0:
+                        assembled = (choices[0].get('message') or {}).get('content', '')
+                    else:
+                        assembled = str(rd)
+                else:
+                    assembled = str(resp)
+            except Exception:
+                assembled = str(resp)
+
+    return assembled.strip()
+
+
+def prepare_calls(steps: Tuple[Step, ...], provider: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Build the LiteLLM kwargs of every step of a case for one provider."""
+    calls = []
     for step in steps:
         # TODO: Add support for multi-turn evaluation cases for models. (might do this, or implement it in agents)
-        message_content = step["content"]
-        max_tokens = step.get("max_tokens")
-        expectations = step.get("expectations", [])
-
+        message_content = resolve_message_content(step.content)
         messages = [
             {
                 "role": "user",
                 "content": message_content
             }
         ]
-        kwargs = {}
-        allowed_keys = ['model', 'api_base', 'api_key', 'max_tokens']
-        for key in allowed_keys:
-            if provider.get(key):
-                kwargs[key] = provider[key]
-        kwargs["messages"] = messages
+        kwargs = {**provider["_kwargs"], "messages": messages}
+        if step.max_tokens is not None:
+            kwargs["max_tokens"] = step.max_tokens
 
         # Enable streaming to avoid Ollama timing out before model responds.
         kwargs.setdefault('stream', True)
+        calls.append(kwargs)
+    return calls
+
+
+# Prepared calls of each test (a case on a provider), keyed by node id
+_PREPARED_CALLS: Dict[str, List[Dict[str, Any]]] = {}
+
+
+@pytest.mark.parametrize(
+    "id, steps",
+    [
+        pytest.param(
+            case_id, case_steps,
+            marks=pytest.mark.repeated(times=repeat, threshold=threshold)
+        )
+        for case_id, repeat, threshold, case_steps in zip(*EVALUATION_CASES)
+    ],
+    ids=EVALUATION_CASES.ids
+)
+@pytest.mark.parametrize("provider", PROVIDERS, ids=lambda x: x["model"] + (' on ' + x["api_base"] if x.get("api_base") else ''))
+def test_extract_calories(id, steps, provider, request):
+    # pytest-repeated runs this test many times with the same inputs; build the calls once
+    calls = _PREPARED_CALLS.get(request.node.nodeid)
+    if calls is None:
+        calls = _PREPARED_CALLS[request.node.nodeid] = prepare_calls(steps, provider)
+
+    for step, kwargs in zip(steps, calls):
+        expectations = step.expectations
 
         with warnings.catch_warnings():
             start_time = time.time()
@@ -244,141 +668,15 @@ def test_extract_calories(id, steps, provider, request):
                 request.node._timing_data = []
             request.node._timing_data.append(call_duration)
 
-        # Assemble actual text from streamed response chunks (robust handling)
-        def _assemble_response(resp):
-            assembled = ''
+        actual = assemble_response(response)
 
-            # Streaming iterator case
-            if hasattr(resp, '__iter__') and not isinstance(resp, dict):
-                for chunk in resp:
-                    d = None
-                    # Prefer a structured dict representation when available
-                    if hasattr(chunk, 'to_dict'):
-                        try:
-                            d = chunk.to_dict()
-                        except Exception:
-                            d = None
-                    elif isinstance(chunk, dict):
-                        d = chunk
-
-                    content = None
-                    if isinstance(d, dict):
-                        # Common streaming shapes: choices[0].delta.content or choices[0].message.content
-                        choices = d.get('choices')
-                        if choices and isinstance(choices, list) and len(choices) > 0:
-                            first = choices[0]
-                            if isinstance(first, dict):
-                                delta = first.get('delta') or {}
-                                if isinstance(delta, dict) and 'content' in delta:
-                                    content = delta.get('content')
-                                elif isinstance(first.get('message'), dict):
-                                    content = first.get('message', {}).get('content')
-
-                        # fallback top-level fields sometimes used by providers
-                        if content is None:
-                            if 'text' in d:
-                                content = d.get('text')
-                            elif 'content' in d:
-                                content = d.get('content')
-                    else:
-                        # primitive chunk shapes
-                        if isinstance(chunk, bytes):
-                            try:
-                                content = chunk.decode('utf-8')
-                            except Exception:
-                                content = str(chunk)
-                        else:
-                            content = str(chunk)
-
-                    if content is None:
-                        continue
-                    if isinstance(content, list):
-                        assembled += ''.join(map(str, content))
-                    else:
-                        assembled += str(content)
-
-            else:
-                # Non-streaming response — try common shapes
-                if isinstance(resp, dict):
-                    choices = resp.get('choices')
-                    if choices and isinstance(choices, list) and len(choices) > 0:
-                        first = choices[0]
-                        if isinstance(first, dict):
-                            msg = first.get('message') or {}
-                            if isinstance(msg, dict) and 'content' in msg:
-                                assembled = msg.get('content') or ''
-                            else:
-                                assembled = first.get('text') or first.get('content') or str(first)
-                        else:
-                            assembled = str(first)
-                    else:
-                        assembled = str(resp)
-                else:
-                    try:
-                        if hasattr(resp, 'to_dict'):
-                            rd = resp.to_dict()
-                            choices = rd.get('choices')
-                            if choices and isinstance(choices, list) and len(choices) > 0:
-                                assembled = (choices[0].get('message') or {}).get('content', '')
-                            else:
-                                assembled = str(rd)
-                        else:
-                            assembled = str(resp)
-                    except Exception:
-                        assembled = str(resp)
-
-            return assembled.strip()
-
-        actual = _assemble_response(response)
-
-        # Try to parse as JSON if any expectation expects a dict-shaped value.
-        # This includes direct `value` dicts as well as `oneOf`/`values` lists
-        # where each candidate is a dict. If parsing fails, keep as string.
         actual_parsed = actual
-        for expectation in expectations:
-            val = expectation.get("value")
-            vals = expectation.get("values")
-            needs_parse = False
-            if isinstance(val, dict):
-                needs_parse = True
-            elif isinstance(vals, list) and any(isinstance(v, dict) for v in vals):
-                needs_parse = True
-
-            if needs_parse:
-                try:
-                    actual_parsed = json.loads(actual)
-                except (json.JSONDecodeError, ValueError):
-                    # If parsing fails, keep as string and let comparisons handle it
-                    pass
-                break
-
-        for expectation in expectations:
-            if expectation["type"] == "contains":
-                assert expectation["value"] in actual, f"Expectation failed: response does not contain '{expectation['value']}'"
-            elif expectation["type"] == "equals":
-                expect_equality(actual_parsed, expectation)
-            elif expectation["type"] == "oneOf":
-                expected_values = expectation["values"]
-                if not isinstance(expected_values, list):
-                    raise ValueError(f"oneOf expectation requires a list of values, got {type(expected_values)}")
-                matched = False
-                errors = []
-                for expected_value in expected_values:
-                    try:
-                        expect_equality(actual_parsed, {"value": expected_value})
-                        matched = True
-                        break
-                    except (AssertionError, Exception) as e:
-                        errors.append(str(e))
-                if not matched:
-                    raise AssertionError(f"Expectation failed: response '{actual_parsed}' does not match any of {expected_values}. Errors: {errors}")
-            elif expectation["type"] in {"regex", "regexp", "regular_expression", "match"}:
-                if not re.search(expectation["value"], actual):
-                    raise AssertionError(f"Expectation failed: response '{actual}' does not match regex '{expectation['value']}'")
-            elif expectation["type"] in {"in_range", "range", "within_range"}:
-                expect_in_range(actual, expectation)
-            elif expectation["type"] in {"approx_pct", "approximate_percentage", "percent_error", "within_percentage"}:
-                expect_approx_pct(actual, expectation)
-            else:
-                raise ValueError(f"Unknown expectation type: {expectation['type']}")
+        if step.parse_json:
+            try:
+                actual_parsed = _json_loads(actual)
+            except ValueError:
+                # If parsing fails, keep as string and let comparisons handle it
+                pass
+
+        check_expectations(actual, actual_parsed, expectations)
     sleep(1)
\ No newline at end of file
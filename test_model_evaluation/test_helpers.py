@@ -1,13 +1,9 @@
 import pytest
-import sys
 from pathlib import Path
 from PIL import Image
 import io
 import base64
 
-# Import from helpers/evaluation_helpers.py
-sys.path.insert(0, '/')
-
 from helpers.evaluation_helpers import (
     expect_equality,
     expect_in_range,
@@ -165,6 +161,19 @@ class TestExpectApproxPct:
         with pytest.raises(AssertionError):
             expect_approx_pct("102", {"value": "100", "tolerance_pct": "1"})
 
+    def test_approx_pct_with_negative_value(self):
+        """Should apply the tolerance to the magnitude of a negative value."""
+        expect_approx_pct("-95", {"value": "-100", "tolerance_pct": "10"})
+        with pytest.raises(AssertionError, match="approx_pct failed"):
+            expect_approx_pct("-111", {"value": "-100", "tolerance_pct": "10"})
+
+    def test_approx_pct_fails_with_nan(self):
+        """Should fail when the output or the expected value is NaN."""
+        with pytest.raises(AssertionError, match="approx_pct failed"):
+            expect_approx_pct("nan", {"value": "100", "tolerance_pct": "10"})
+        with pytest.raises(AssertionError, match="approx_pct failed"):
+            expect_approx_pct("100", {"value": "nan", "tolerance_pct": "10"})
+
 
 class TestConvertImageToJpegBase64:
     """Test the convert_image_to_jpeg_base64 function."""
@@ -185,6 +194,14 @@ class TestConvertImageToJpegBase64:
         img.save(img_path)
         return img_path
 
+    @pytest.fixture
+    def temp_jpeg_image(self, tmp_path):
+        """Create a temporary RGB JPEG image for testing."""
+        img_path = tmp_path / "test_rgb.jpeg"
+        img = Image.new('RGB', (100, 100), color='red')
+        img.save(img_path, format='JPEG', quality=95)
+        return img_path
+
     def test_converts_rgb_image_to_base64(self, temp_rgb_image):
         """Should convert RGB image to base64 data URL."""
         result = convert_image_to_jpeg_base64(temp_rgb_image)
@@ -232,3 +249,52 @@ class TestConvertImageToJpegBase64:
         img = Image.open(io.BytesIO(decoded))
         assert img.format == 'JPEG'
         assert img.size == (100, 100)
+
+    def test_small_jpeg_is_passed_through_unchanged(self, temp_jpeg_image):
+        """Should base64-encode the original bytes of a small RGB JPEG without re-encoding."""
+        result = convert_image_to_jpeg_base64(temp_jpeg_image)
+        base64_data = result.split(",", 1)[1]
+        assert base64.b64decode(base64_data) == temp_jpeg_image.read_bytes()
+
+    def test_accepts_string_path(self, temp_jpeg_image):
+        """Should accept the image path as a string."""
+        result = convert_image_to_jpeg_base64(str(temp_jpeg_image))
+        assert result.startswith("data:image/jpeg;base64,")
+
+    def test_jpeg_with_exif_is_reencoded_without_it(self, tmp_path):
+        """Should not pass a JPEG with EXIF data through, so its EXIF is not sent."""
+        img_path = tmp_path / "test_exif.jpeg"
+        exif = Image.Exif()
+        exif[0x0112] = 6  # Orientation
+        Image.new('RGB', (100, 100), color='red').save(img_path, format='JPEG', exif=exif)
+
+        result = convert_image_to_jpeg_base64(img_path)
+        decoded = base64.b64decode(result.split(",", 1)[1])
+        assert decoded != img_path.read_bytes()
+        assert 'exif' not in Image.open(io.BytesIO(decoded)).info
+
+    def test_jpeg_is_reencoded_when_passthrough_disabled(self, temp_jpeg_image):
+        """Should re-encode a JPEG at the requested quality when passthrough_max_bytes is 0."""
+        result = convert_image_to_jpeg_base64(temp_jpeg_image, quality=10, passthrough_max_bytes=0)
+        base64_data = result.split(",", 1)[1]
+        decoded = base64.b64decode(base64_data)
+        assert decoded != temp_jpeg_image.read_bytes()
+        assert Image.open(io.BytesIO(decoded)).format == 'JPEG'
+
+    def test_grayscale_image_is_not_converted_to_rgb(self, tmp_path):
+        """Should encode a grayscale image as a grayscale JPEG."""
+        img_path = tmp_path / "test_gray.png"
+        Image.new('L', (100, 100), color=128).save(img_path)
+
+        result = convert_image_to_jpeg_base64(img_path)
+        decoded = base64.b64decode(result.split(",", 1)[1])
+        assert Image.open(io.BytesIO(decoded)).mode == 'L'
+
+    def test_downscales_images_larger_than_max_side(self, tmp_path):
+        """Should shrink the longer side to max_side, keeping the aspect ratio."""
+        img_path = tmp_path / "test_large.png"
+        Image.new('RGB', (400, 200), color='red').save(img_path)
+
+        result = convert_image_to_jpeg_base64(img_path, max_side=100)
+        decoded = base64.b64decode(result.split(",", 1)[1])
+        assert Image.open(io.BytesIO(decoded)).size == (100, 50)